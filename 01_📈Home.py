@@ -1,9 +1,14 @@
+import numpy as np
 import pandas as pd
 import inflection
 import folium
 from folium.plugins import MarkerCluster
+from branca.colormap import LinearColormap
 from PIL import Image
 import streamlit as st
+
+from foodzone import (COLORS, EXCHANGE_RATES, additive_node, compute_node, export_sidebar,
+                      reset_node_stats, show_node_stats, source_node, validate_data)
 from streamlit_folium import folium_static
 
 # Load dataset
@@ -47,21 +52,6 @@ def country_name(country_id):
     return COUNTRIES.get(country_id, "")
 
 # Convert values to USD
-EXCHANGE_RATES = {
-    'Botswana Pula(P)': 0.018,
-    'Brazilian Real(R$)': 0.20,
-    'Emirati Diram(AED)': 0.27,
-    'Indian Rupees(Rs.)': 0.012,
-    'Indonesian Rupiah(IDR)': 0.000067,
-    'NewZealand($)': 0.62,
-    'Pounds(£)': 1.24,
-    'Qatari Rial(QR)': 0.27,
-    'Rand(R)': 0.053,
-    'Sri Lankan Rupee(LKR)': 0.0033,
-    'Turkish Lira(TL)': 0.050,
-    'Dollar($)': 1.0
-}
-
 def convert_to_usd(amount, currency):
     exchange_rate = EXCHANGE_RATES.get(currency)
     if exchange_rate is not None:
@@ -69,38 +59,77 @@ def convert_to_usd(amount, currency):
     else:
         return None
 
-# colors
-COLORS = {
-"3F7E00": "darkgreen",
-"5BA829": "green",
-"9ACD32": "lightgreen",
-"CDD614": "orange",
-"FFBA00": "red",
-"CBCBC8": "darkred",
-"FF7800": "darkred",
-}
-
+# Rating colors
 def color_name(color_code):
-    return COLORS[color_code]
+    return COLORS.get(color_code)
 
 # Data cleaning and transformation
 def data_transform(df):
-    # Drop rows with null values
-    df = df.dropna()
-
-    # Drop duplicate values
-    df = df.drop_duplicates().reset_index(drop=True)
+    # Validate and drop duplicated restaurants in a single pass
+    df, report = validate_data(df)
 
     # Simplify the cuisines column
-    df["cuisines"] = df["cuisines"].str.split(",").str[0]
+    df["cuisines"] = df["cuisines"].fillna("Others").str.split(",").str[0]
 
-    # Drop outliers
-    df = df[df['amount_usd'] != 25000017.0]
+    return df, report
 
-    return df
+# Map grid cell sizes in degrees
+GRID_RESOLUTIONS = {
+    'Country': 2.0,
+    'City': 0.25,
+    'District': 0.05,
+    'Neighbourhood': 0.01,
+}
+
+RATING_COLORS = LinearColormap(['darkred', 'orange', 'lightgreen', 'darkgreen'], vmin=0, vmax=5,
+                               caption='AVG rating')
+
+@st.cache_data
+def grid_aggregates(df):
+    # Additive sums per country and cell, for every resolution
+    grids = {}
+    for name, size in GRID_RESOLUTIONS.items():
+        cell_lat = np.floor(df['latitude'] / size).astype(int).rename('cell_lat')
+        cell_lon = np.floor(df['longitude'] / size).astype(int).rename('cell_lon')
+        grids[name] = df.groupby([df['country_code'], cell_lat, cell_lon]).agg(
+            restaurants=('restaurant_id', 'size'),
+            rating_sum=('aggregate_rating', 'sum'),
+            price_sum=('amount_usd', 'sum'),
+            priced=('amount_usd', 'count'),
+        )
+    return grids
+
+def grid_cells(grid, countries):
+    selected = grid.index.get_level_values('country_code').isin(countries)
+    cells = grid[selected].groupby(level=['cell_lat', 'cell_lon']).sum()
+    cells['aggregate_rating'] = (cells['rating_sum'] / cells['restaurants']).round(2)
+    cells['amount_usd'] = (cells['price_sum'] / cells['priced']).round(2)
+    return cells.reset_index()
+
+def grid_geojson(cells, size):
+    features = []
+    for cell_lat, cell_lon, restaurants, rating, price in zip(
+            cells['cell_lat'], cells['cell_lon'], cells['restaurants'],
+            cells['aggregate_rating'], cells['amount_usd']):
+        south, west = cell_lat * size, cell_lon * size
+        north, east = south + size, west + size
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+            },
+            'properties': {
+                'restaurants': int(restaurants),
+                'aggregate_rating': float(rating),
+                'amount_usd': None if np.isnan(price) else float(price),
+                'color': RATING_COLORS(rating),
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
 
 # Data visualization
-def data_viz(df):
+def data_viz(df, report):
     # Set Streamlit page
     st.set_page_config(layout='wide')
 
@@ -118,8 +147,27 @@ def data_viz(df):
         default=df['country_code'].unique()
     )
 
+    # Map layer
+    map_layer = st.sidebar.radio('Map', ['Density grid', 'Restaurants'])
+    if map_layer == 'Density grid':
+        grid_resolution = st.sidebar.select_slider('Grid cell size', options=list(GRID_RESOLUTIONS), value='City')
+
+    # Data quality report
+    with st.sidebar.expander('Data quality'):
+        st.dataframe(report, use_container_width=True)
+
     # Filter functionality
-    df_filtered = df[df['country_code'].isin(country_filter)]
+    countries = frozenset(country_filter)
+    select_row = compute_node('home/mask', deps=['home/df'], params=countries,
+                              compute=lambda df: df['country_code'].isin(countries).to_numpy())
+
+    # Per country partials, the metrics add or subtract them as countries change
+    compute_node('home/city_partials', deps=['home/df'],
+                 compute=lambda df: df.groupby(['country_code', 'city']).agg(restaurants=('restaurant_id', 'size'), votes=('votes', 'sum')))
+    compute_node('home/cuisine_partials', deps=['home/df'],
+                 compute=lambda df: df.groupby(['country_code', 'cuisines']).agg(restaurants=('restaurant_id', 'size')))
+    cities = additive_node('home/cities', 'home/city_partials', countries)
+    cuisines = additive_node('home/cuisines', 'home/cuisine_partials', countries)
 
     st.title('Food Zone')
     st.markdown('#### Your food, in your Zone')
@@ -128,28 +176,67 @@ def data_viz(df):
     with st.container():
         col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
-            st.metric(value=df_filtered.shape[0], label='Restaurants')
+            st.metric(value=cities['restaurants'].sum(), label='Restaurants')
         with col2:
-            st.metric(value=df_filtered['country_code'].nunique(), label='Countries')
+            st.metric(value=len(countries), label='Countries')
         with col3:
-            st.metric(value=df_filtered['city'].nunique(), label='Cities')
+            st.metric(value=len(cities), label='Cities')
         with col4:
-            st.metric(value=df_filtered['votes'].sum(), label='Total Votes')
+            st.metric(value=cities['votes'].sum(), label='Total Votes')
         with col5:
-            st.metric(value=df_filtered['cuisines'].nunique(), label='Cuisines')
+            st.metric(value=len(cuisines), label='Cuisines')
 
     with st.container():
         map = folium.Map(location=[df['latitude'].mean(), df['longitude'].mean()], zoom_start=2)
-        make_cluster = MarkerCluster().add_to(map)
-        for _, row in df_filtered.iterrows():
-            popup = folium.Popup('Price: ${0}, {1}'.format(row['amount_usd'], row['rating_text']))
-            folium.Marker(location=[row['latitude'], row['longitude']], popup=popup,
-                          icon=folium.Icon(icon='home', color=row['color_name'])).add_to(make_cluster)
+        if map_layer == 'Density grid':
+            # One GeoJSON layer, sized by the number of cells instead of restaurants
+            compute_node('home/grid_aggregates', grid_aggregates, deps=['home/df'])
+            cells = compute_node('home/grid_cells', deps=['home/grid_aggregates'], params=(countries, grid_resolution),
+                                 compute=lambda grids: grid_cells(grids[grid_resolution], countries))
+            geojson = compute_node('home/grid_geojson', deps=['home/grid_cells'],
+                                   compute=lambda cells: grid_geojson(cells, GRID_RESOLUTIONS[grid_resolution]))
+            # The tooltip fails on a layer without features, so an empty selection draws no grid
+            if geojson['features']:
+                folium.GeoJson(
+                    geojson,
+                    style_function=lambda feature: {
+                        'fillColor': feature['properties']['color'],
+                        'color': feature['properties']['color'],
+                        'weight': 1,
+                        'fillOpacity': 0.6,
+                    },
+                    tooltip=folium.GeoJsonTooltip(
+                        fields=['restaurants', 'aggregate_rating', 'amount_usd'],
+                        aliases=['Restaurants', 'AVG rating', 'AVG price for two'],
+                    ),
+                ).add_to(map)
+                RATING_COLORS.add_to(map)
+            else:
+                st.warning('No restaurants in the selected countries')
+        else:
+            make_cluster = MarkerCluster().add_to(map)
+            for _, row in df[select_row].iterrows():
+                popup = folium.Popup('Price: ${0}, {1}'.format(row['amount_usd'], row['rating_text']))
+                folium.Marker(location=[row['latitude'], row['longitude']], popup=popup,
+                              icon=folium.Icon(icon='home', color=row['color_name'])).add_to(make_cluster)
 
         folium_static(map, width=1024, height=600)
 
-# Main function
-def main():
+    # Downloads of the filtered rows and the aggregates behind the page
+    sources = {
+        'Filtered restaurants': (df, select_row),
+        'Cities': cities,
+        'Cuisines': cuisines,
+    }
+    if map_layer == 'Density grid':
+        sources['Map grid cells'] = cells
+    export_sidebar('home', sources)
+
+    show_node_stats()
+
+# Load and clean the dataset once, every session shares this frame and never modifies it
+@st.cache_resource
+def prepare_data():
     # Load data
     data = load_data('dataset/zomato.csv')
 
@@ -166,10 +253,17 @@ def main():
     data['color_name'] = data['rating_color'].map(color_name)
 
     # Apply data cleaning and transformation
-    df = data_transform(data)
+    return data_transform(data)
+
+# Main function
+def main():
+    # The dataset is shared, the session keeps a reference and its derived nodes
+    reset_node_stats()
+    df, report = prepare_data()
+    source_node('home/df', df)
 
     # Perform data visualization
-    data_viz(df)
+    data_viz(df, report)
 
 # Run the main function
 if __name__ == '__main__':
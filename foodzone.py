@@ -0,0 +1,247 @@
+import io
+
+import numpy as np
+import pandas as pd
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+# Convert values to USD
+EXCHANGE_RATES = {
+    'Botswana Pula(P)': 0.018,
+    'Brazilian Real(R$)': 0.20,
+    'Emirati Diram(AED)': 0.27,
+    'Indian Rupees(Rs.)': 0.012,
+    'Indonesian Rupiah(IDR)': 0.000067,
+    'NewZealand($)': 0.62,
+    'Pounds(£)': 1.24,
+    'Qatari Rial(QR)': 0.27,
+    'Rand(R)': 0.053,
+    'Sri Lankan Rupee(LKR)': 0.0033,
+    'Turkish Lira(TL)': 0.050,
+    'Dollar($)': 1.0
+}
+
+# Rating colors
+COLORS = {
+"3F7E00": "darkgreen",
+"5BA829": "green",
+"9ACD32": "lightgreen",
+"CDD614": "orange",
+"FFBA00": "red",
+"CBCBC8": "darkred",
+"FF7800": "darkred",
+}
+
+# Robust outlier detection
+# Modified z-score of the log price inside each country. The usual cutoff is 3.5,
+# but real premium restaurants score up to about 7 here (the priciest ones in
+# South Africa), while entry errors are orders of magnitude off (the 25,000,017
+# AUD row scores about 30), so 10 keeps every real price and catches those errors.
+OUTLIER_THRESHOLD = 10.0
+
+def price_outliers(df):
+    # Prices of zero or less are missing values, the rest are checked on both sides
+    log_price = np.log(df['amount_usd'].where(df['amount_usd'] > 0))
+    median = log_price.groupby(df['country_code']).transform('median')
+    deviation = log_price - median
+    mad = deviation.abs().groupby(df['country_code']).transform('median')
+    z_score = 0.6745 * deviation / mad.replace(0, np.nan)
+    return (df['amount_usd'] <= 0) | (z_score.abs() > OUTLIER_THRESHOLD)
+
+# Data validation
+REQUIRED_COLUMNS = ['restaurant_id', 'restaurant_name', 'country_code', 'city', 'longitude', 'latitude',
+                    'average_cost_for_two', 'currency', 'has_table_booking', 'has_online_delivery',
+                    'price_range', 'aggregate_rating', 'rating_color', 'votes']
+
+VALID_RANGES = {
+    'longitude': (-180.0, 180.0),
+    'latitude': (-90.0, 90.0),
+    'average_cost_for_two': (0.0, np.inf),
+    'price_range': (1, 4),
+    'aggregate_rating': (0.0, 5.0),
+    'votes': (0, np.inf),
+}
+
+FLAG_COLUMNS = ['has_table_booking', 'has_online_delivery']
+
+def validate_data(df):
+    missing = set(REQUIRED_COLUMNS) - set(df.columns)
+    if missing:
+        raise ValueError(f'Missing columns: {sorted(missing)}')
+
+    # Numeric columns read as text are parsed, values that do not parse are reported
+    numeric = {col: pd.to_numeric(df[col], errors='coerce') for col in [*VALID_RANGES, *FLAG_COLUMNS]}
+    wrong_type = [values.isna() & df[col].notna() for col, values in numeric.items()]
+    out_of_range = [~numeric[col].between(low, high) & numeric[col].notna() for col, (low, high) in VALID_RANGES.items()]
+    invalid_flag = [~numeric[col].isin([0, 1]) & numeric[col].notna() for col in FLAG_COLUMNS]
+
+    # Each check flags the rows it rejects, all computed over the same frame
+    checks = {
+        'Missing values': df[REQUIRED_COLUMNS].isna().any(axis=1),
+        'Wrong type': np.logical_or.reduce(wrong_type),
+        'Out of range': np.logical_or.reduce(out_of_range),
+        'Invalid flag': np.logical_or.reduce(invalid_flag),
+        'Unknown currency': ~df['currency'].isin(EXCHANGE_RATES.keys()),
+        'Unknown color': ~df['rating_color'].isin(COLORS.keys()),
+    }
+    rejected = np.logical_or.reduce(list(checks.values()))
+
+    # Keep the last valid row of each restaurant
+    checks['Duplicated'] = df['restaurant_id'].where(~rejected).duplicated(keep='last') & ~rejected
+    keep = np.flatnonzero(~(rejected | checks['Duplicated']))
+
+    report = pd.Series({name: int(flags.sum()) for name, flags in checks.items()}, name='Rows')
+    report['Kept'] = len(keep)
+
+    # A single take of the valid rows, with the parsed values of text columns
+    df = df.take(keep)
+    df.index = pd.RangeIndex(len(df))
+    for col, values in numeric.items():
+        if values.dtype != df[col].dtype:
+            df[col] = values.to_numpy()[keep]
+
+    # A missing or wrong price says nothing about the rest of the row, so the restaurant
+    # is kept and only its price is cleared, price charts and means skip it
+    outliers = price_outliers(df)
+    df['amount_usd'] = df['amount_usd'].mask(outliers)
+    report['Price cleared'] = int(outliers.sum())
+    return df, report
+
+# Incremental recompute
+def reset_node_stats():
+    st.session_state['node_stats'] = {'computed': 0, 'skipped': 0, 'incremental': 0}
+
+def source_node(name, value):
+    # Shared inputs, like the dataset from st.cache_resource: the session keeps a reference,
+    # not a copy, and a new object (cache cleared or reloaded) bumps the version. The node
+    # holds the old object until the check, so its id can't be reused by the new one
+    nodes = st.session_state.setdefault('nodes', {})
+    node = nodes.get(name)
+    key = id(value)
+    if node is None or node['key'] != key:
+        version = 0 if node is None else node['version'] + 1
+        node = nodes[name] = {'key': key, 'version': version}
+    node['value'] = value
+    return value
+
+def compute_node(name, compute, deps=(), params=None):
+    # Rerun compute only when params or the version of one of its deps changed
+    nodes = st.session_state.setdefault('nodes', {})
+    stats = st.session_state['node_stats']
+    key = (params, tuple(nodes[dep]['version'] for dep in deps))
+    node = nodes.get(name)
+    if node is not None and node['key'] == key:
+        stats['skipped'] += 1
+        return node['value']
+
+    value = compute(*(nodes[dep]['value'] for dep in deps))
+    version = 0 if node is None else node['version'] + 1
+    nodes[name] = {'key': key, 'value': value, 'version': version}
+    stats['computed'] += 1
+    return value
+
+def additive_node(name, partials, selection):
+    # Sum the rows of partials, indexed by (filter value, group), for the selected
+    # values, adding or subtracting only the values that changed since the last run
+    nodes = st.session_state.setdefault('nodes', {})
+    stats = st.session_state['node_stats']
+    selection = frozenset(selection)
+    data, data_version = nodes[partials]['value'], nodes[partials]['version']
+    node = nodes.get(name)
+
+    def total(values):
+        rows = data[data.index.get_level_values(0).isin(values)]
+        return rows.groupby(level=1).sum()
+
+    if node is not None and node['partials'] == data_version:
+        added, removed = selection - node['selection'], node['selection'] - selection
+        if not added and not removed:
+            stats['skipped'] += 1
+            return node['value']
+    if node is None or node['partials'] != data_version or len(added) + len(removed) >= len(selection):
+        value = total(selection)
+        stats['computed'] += 1
+    else:
+        value = node['value']
+        if added:
+            value = value.add(total(added), fill_value=0)
+        if removed:
+            value = value.sub(total(removed), fill_value=0)
+        value = value[(value != 0).any(axis=1)].astype(data.dtypes.to_dict())
+        stats['incremental'] += 1
+
+    version = 0 if node is None else node['version'] + 1
+    nodes[name] = {'partials': data_version, 'selection': selection, 'value': value, 'version': version}
+    return value
+
+def show_node_stats():
+    stats = st.session_state['node_stats']
+    st.sidebar.caption(f"Nodes recomputed: {stats['computed']} | reused: {stats['skipped']} | "
+                       f"updated incrementally: {stats['incremental']}")
+
+# Export
+EXPORT_FORMATS = {
+    'CSV': ('text/csv', 'csv'),
+    'Parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'XLSX': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+EXPORT_CHUNK_ROWS = 100_000
+
+# openpyxl writes about 3,000 rows a second, so larger selections go to CSV or Parquet
+XLSX_MAX_ROWS = 20_000
+
+def export_chunks(df, mask=None):
+    # Rows selected by the mask, one chunk at a time, never the whole selection
+    rows = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+    for start in range(0, len(rows), EXPORT_CHUNK_ROWS):
+        yield df.take(rows[start:start + EXPORT_CHUNK_ROWS])
+
+def export_data(file_format, df, mask=None):
+    # Named indexes, like the groups of an aggregate, are exported as columns
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+    buffer = io.BytesIO()
+
+    if file_format == 'CSV':
+        df.head(0).to_csv(buffer, index=False)
+        for chunk in export_chunks(df, mask):
+            chunk.to_csv(buffer, header=False, index=False)
+
+    elif file_format == 'Parquet':
+        # Types come from the whole frame, a column empty in the first chunk would be null
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        with pq.ParquetWriter(buffer, schema) as writer:
+            for chunk in export_chunks(df, mask):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+    elif file_format == 'XLSX':
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('data')
+        sheet.append(list(df.columns))
+        for chunk in export_chunks(df, mask):
+            for row in chunk.itertuples(index=False, name=None):
+                sheet.append(row)
+        workbook.save(buffer)
+
+    # The download button reads the buffer itself, its bytes are not copied here
+    buffer.seek(0)
+    return buffer
+
+def export_sidebar(page, sources):
+    # sources maps a label to a frame, or to a (frame, mask) pair
+    st.sidebar.write("""___""")
+    st.sidebar.markdown('# Export')
+    source = st.sidebar.selectbox('Data', list(sources))
+    file_format = st.sidebar.selectbox('Format', list(EXPORT_FORMATS))
+    data = sources[source] if isinstance(sources[source], tuple) else (sources[source],)
+    rows = len(data[0]) if len(data) == 1 else int(np.count_nonzero(data[1]))
+
+    if file_format == 'XLSX' and rows > XLSX_MAX_ROWS:
+        st.sidebar.warning(f'XLSX is limited to {XLSX_MAX_ROWS:,} rows and this data has {rows:,}, use CSV or Parquet')
+    # Serialized only on request, the file lives for this run and is never kept in the session
+    elif st.sidebar.button('Prepare download'):
+        mime, extension = EXPORT_FORMATS[file_format]
+        file_name = f"{page}_{source.lower().replace(' ', '_')}.{extension}"
+        st.sidebar.download_button('Download', data=export_data(file_format, *data), file_name=file_name, mime=mime)
@@ -1,8 +1,11 @@
+import numpy as np
 import pandas as pd
 import inflection
 import plotly.express as px
 import streamlit as st
 
+from foodzone import (EXCHANGE_RATES, compute_node, export_sidebar, reset_node_stats, show_node_stats, source_node, validate_data)
+
 from PIL import Image
 
 # Load dataset
@@ -47,41 +50,79 @@ def country_name(country_id):
     return COUNTRIES[country_id]
 
 # Convert values to us dollar
-exchange_rates = {
-    'Botswana Pula(P)': 0.018,
-    'Brazilian Real(R$)': 0.20,
-    'Emirati Diram(AED)': 0.27,
-    'Indian Rupees(Rs.)': 0.012,
-    'Indonesian Rupiah(IDR)': 0.000067,
-    'NewZealand($)': 0.62,
-    'Pounds(£)': 1.24,
-    'Qatari Rial(QR)': 0.27,
-    'Rand(R)': 0.053,
-    'Sri Lankan Rupee(LKR)': 0.0033,
-    'Turkish Lira(TL)': 0.050,
-    'Dollar($)' : 1.0
-}
-
 def convert_to_usd(amount, currency):
-    if currency in exchange_rates:
-        return amount * exchange_rates[currency]
+    if currency in EXCHANGE_RATES:
+        return amount * EXCHANGE_RATES[currency]
     else:
         return None
 
+# Price bands: log spaced USD bins, four per doubling, from 1 USD up to the
+# first power of two above the highest price, so no price is clamped
+def price_bins(max_price):
+    doublings = max(10, int(np.ceil(np.log2(max(max_price, 1.0)))))
+    return np.concatenate([[0.0], np.geomspace(1.0, 2.0 ** doublings, 4 * doublings + 1)])
+
+@st.cache_data
+def price_histograms(df):
+    # Rows without a price only count in the price range shares
+    priced = df[df['amount_usd'].notna()]
+    bins = price_bins(priced['amount_usd'].max())
+    band = np.searchsorted(bins, priced['amount_usd'].to_numpy(), side='right') - 1
+    band = np.clip(band, 0, len(bins) - 2)
+    amount_hist = (priced.groupby(['country_code', 'city', band]).size()
+                   .unstack(fill_value=0)
+                   .reindex(columns=range(len(bins) - 1), fill_value=0))
+    range_hist = df.groupby(['country_code', 'city', 'price_range']).size().unstack(fill_value=0)
+    return amount_hist, range_hist, bins
+
+def histogram_quantile(hist, bins, q):
+    # Interpolate the q quantile of each row inside its band, O(bins) per row
+    counts = hist.to_numpy(dtype=float)
+    cumulative = counts.cumsum(axis=1)
+    target = q * cumulative[:, -1]
+    band = np.minimum((cumulative < target[:, None]).sum(axis=1), counts.shape[1] - 1)
+    rows = np.arange(len(counts))
+    inside = counts[rows, band]
+    below = cumulative[rows, band] - inside
+    fraction = np.divide(target - below, inside, out=np.zeros_like(target), where=inside > 0)
+    low, high = bins[band], bins[band + 1]
+    return pd.Series(low + fraction * (high - low), index=hist.index)
+
+def price_quantiles(country_hist, bins):
+    return pd.DataFrame({
+        'Median': histogram_quantile(country_hist, bins, 0.5),
+        'P90': histogram_quantile(country_hist, bins, 0.9),
+    }).round(2).sort_values('Median', ascending=False).reset_index()
+
+def price_range_share(country_range):
+    range_by_country = country_range.div(country_range.sum(axis=1), axis=0).mul(100).round(1)
+    range_by_country = range_by_country.reset_index().melt(id_vars='country_code', var_name='price_range', value_name='share')
+    range_by_country['price_range'] = range_by_country['price_range'].astype(str)
+    return range_by_country
+
+def select_countries(hist, countries):
+    return hist[hist.index.get_level_values('country_code').isin(countries)]
+
+def country_stats(df):
+    # Final values of each country, the filter selects whole countries so no chart
+    # has to group the dataset again, the price mean skips rows without a price
+    return df.groupby('country_code').agg(
+        restaurant_id=('restaurant_id', 'nunique'),
+        city=('city', 'nunique'),
+        votes=('votes', 'mean'),
+        amount_usd=('amount_usd', 'mean'),
+    )
+
+def country_column(stats, countries, column):
+    return select_countries(stats, countries)[column].sort_values(ascending=False).reset_index()
+
 # Data cleaning and transformation
 def data_transform(df):
-   # drop rows with null values
-    df = df.dropna()
-
-    # drop duplicate values
-    df = df.drop_duplicates().reset_index(drop=True)
+    # validate and drop duplicated restaurants in a single pass
+    df, _ = validate_data(df)
 
     #simplify the cuisines column
-    df["cuisines"] = df.loc[:, "cuisines"].apply(lambda x: x.split(",")[0])
-
-    # drop outliers
-    filt = df['amount_usd'] != 25000017.0
-    df = df.loc[filt, :]
+    df["cuisines"] = df["cuisines"].fillna("Others").str.split(",").str[0]
     return df
 
 # Data visualization
@@ -101,11 +142,16 @@ def data_viz(df):
         options=df['country_code'].unique(),
         default=df['country_code'].unique()
     )
+    countries = frozenset(country_filter)
+
 
+    # Price histograms and country stats over the full dataset, the filter only selects rows of them
+    compute_node('countries/price_histograms', price_histograms, deps=['countries/df'])
+    compute_node('countries/country_stats', country_stats, deps=['countries/df'])
 
-    # Filter functionality 
-    select_row = df['country_code'].isin(country_filter)
-    df = df.loc[select_row, :]
+    # Filter functionality, one mask over the dataset shared by every chart
+    select_row = compute_node('countries/mask', deps=['countries/df'], params=countries,
+                              compute=lambda df: df['country_code'].isin(countries).to_numpy())
 
     st.sidebar.write("""___""")
 
@@ -116,25 +162,29 @@ def data_viz(df):
     with st.container():
 
         
-        restaurant_by_country = df[['restaurant_id', 'country_code']].groupby('country_code').nunique().sort_values('restaurant_id', ascending=False).reset_index()
-        fig = px.bar(restaurant_by_country, 
-                    x='country_code',
-                    y='restaurant_id',
-                    text_auto=True,
-                    labels={'country_code': 'Country', 'restaurant_id': 'Nº Restaurants'},
-                    title='Restaurants per Country'
-        )
+        restaurant_by_country = compute_node('countries/restaurant_by_country', deps=['countries/country_stats'], params=countries,
+                                             compute=lambda stats: country_column(stats, countries, 'restaurant_id'))
+        fig = compute_node('countries/restaurant_by_country_fig', deps=['countries/restaurant_by_country'],
+                           compute=lambda restaurant_by_country: px.bar(restaurant_by_country, 
+                                x='country_code',
+                                y='restaurant_id',
+                                text_auto=True,
+                                labels={'country_code': 'Country', 'restaurant_id': 'Nº Restaurants'},
+                                title='Restaurants per Country'
+                           ))
         st.plotly_chart(fig, use_container_width=True)
 
     # Cities by country bar chart
     with st.container():
-        country_by_city = df[['country_code', 'city']].groupby('country_code').nunique().sort_values('city', ascending=False).reset_index()
-        fig = px.bar(country_by_city,
-                    x='country_code',
-                    y='city', text_auto=True, 
-                    labels={'city': 'Cities', 'country_code': 'Country'},
-                    title='Cities per Country'
-        )
+        country_by_city = compute_node('countries/country_by_city', deps=['countries/country_stats'], params=countries,
+                                       compute=lambda stats: country_column(stats, countries, 'city'))
+        fig = compute_node('countries/country_by_city_fig', deps=['countries/country_by_city'],
+                           compute=lambda country_by_city: px.bar(country_by_city,
+                                x='country_code',
+                                y='city', text_auto=True, 
+                                labels={'city': 'Cities', 'country_code': 'Country'},
+                                title='Cities per Country'
+                           ))
         st.plotly_chart(fig, use_container_width=True)
 
     # Avg votes and price charts
@@ -143,30 +193,97 @@ def data_viz(df):
 
         # AVG votes by restaurant in each country'
         with col1:
-            votes_by_country = df[['country_code', 'votes']].groupby('country_code').mean().sort_values('votes', ascending=False).reset_index()
-            fig = px.bar(votes_by_country,
-                        x='country_code',
-                        y='votes', text_auto=True,
-                        title='AVG votes by restaurant in each country',
-                        labels={'country_code': 'Country', 'votes': 'Votes'}
-            )
+            votes_by_country = compute_node('countries/votes_by_country', deps=['countries/country_stats'], params=countries,
+                                            compute=lambda stats: country_column(stats, countries, 'votes'))
+            fig = compute_node('countries/votes_by_country_fig', deps=['countries/votes_by_country'],
+                               compute=lambda votes_by_country: px.bar(votes_by_country,
+                                    x='country_code',
+                                    y='votes', text_auto=True,
+                                    title='AVG votes by restaurant in each country',
+                                    labels={'country_code': 'Country', 'votes': 'Votes'}
+                               ))
             st.plotly_chart(fig, use_container_width=True)
             
         # AVG price for two by country
         with col2:
-            votes_by_country = df[['country_code', 'amount_usd']].groupby('country_code').mean().sort_values('amount_usd', ascending=False).reset_index()
-            fig = px.bar(votes_by_country, 
-                        x='country_code',
-                        y='amount_usd',
-                        text_auto=True,
-                        title='AVG price for two by country',
-                        labels={'country_code': 'Country', 'amount_usd': 'Price'}
-            )
+            price_by_country = compute_node('countries/price_by_country', deps=['countries/country_stats'], params=countries,
+                                            compute=lambda stats: country_column(stats, countries, 'amount_usd'))
+            fig = compute_node('countries/price_by_country_fig', deps=['countries/price_by_country'],
+                               compute=lambda price_by_country: px.bar(price_by_country, 
+                                    x='country_code',
+                                    y='amount_usd',
+                                    text_auto=True,
+                                    title='AVG price for two by country',
+                                    labels={'country_code': 'Country', 'amount_usd': 'Price'}
+                               ))
+            st.plotly_chart(fig, use_container_width=True)
+
+    # Median and P90 price for two by country
+    with st.container():
+        price_quantiles_by_country = compute_node('countries/price_quantiles_by_country', deps=['countries/price_histograms'], params=countries,
+                                                  compute=lambda hists: price_quantiles(select_countries(hists[0], countries).groupby(level='country_code').sum(), hists[2]))
+        fig = compute_node('countries/price_quantiles_by_country_fig', deps=['countries/price_quantiles_by_country'],
+                           compute=lambda price_by_country: px.bar(price_by_country,
+                                x='country_code',
+                                y=['Median', 'P90'],
+                                barmode='group',
+                                text_auto=True,
+                                title='Median and P90 price for two by country',
+                                labels={'country_code': 'Country', 'value': 'Price', 'variable': 'Quantile'}
+                           ))
+        st.plotly_chart(fig, use_container_width=True)
+
+    # Price range and city price charts
+    with st.container():
+        col1, col2 = st.columns(2)
+
+        # Share of each price range by country
+        with col1:
+            range_by_country = compute_node('countries/range_by_country', deps=['countries/price_histograms'], params=countries,
+                                            compute=lambda hists: price_range_share(select_countries(hists[1], countries).groupby(level='country_code').sum()))
+            fig = compute_node('countries/range_by_country_fig', deps=['countries/range_by_country'],
+                               compute=lambda range_by_country: px.bar(range_by_country,
+                                    x='country_code',
+                                    y='share',
+                                    color='price_range',
+                                    title='Price range share by country (%)',
+                                    labels={'country_code': 'Country', 'share': '% Restaurants', 'price_range': 'Price range'}
+                               ))
+            st.plotly_chart(fig, use_container_width=True)
+
+        # Top 10 cities by median price for two
+        with col2:
+            price_by_city = compute_node('countries/price_by_city', deps=['countries/price_histograms'], params=countries,
+                                         compute=lambda hists: histogram_quantile(select_countries(hists[0], countries), hists[2], 0.5).round(2).nlargest(10).rename('amount_usd').reset_index())
+            fig = compute_node('countries/price_by_city_fig', deps=['countries/price_by_city'],
+                               compute=lambda price_by_city: px.bar(price_by_city,
+                                    x='city',
+                                    y='amount_usd',
+                                    color='country_code',
+                                    text_auto=True,
+                                    title='Top 10 cities by median price for two',
+                                    labels={'city': 'City', 'amount_usd': 'Price', 'country_code': 'Country'}
+                               ))
             st.plotly_chart(fig, use_container_width=True)
 
+    # Downloads of the filtered rows and the aggregates behind each chart
+    export_sidebar('countries', {
+        'Filtered restaurants': (df, select_row),
+        'Restaurants per country': restaurant_by_country,
+        'Cities per country': country_by_city,
+        'AVG votes by country': votes_by_country,
+        'AVG price by country': price_by_country,
+        'Price quantiles by country': price_quantiles_by_country,
+        'Price range share by country': range_by_country,
+        'Top cities by median price': price_by_city,
+    })
 
-# Main function
-def main():
+    show_node_stats()
+
+
+# Load and clean the dataset once, every session shares this frame and never modifies it
+@st.cache_resource
+def prepare_data():
     # Load data
     data = load_data('zomato.csv')
 
@@ -180,7 +297,13 @@ def main():
     data["amount_usd"] = data.apply(lambda row: convert_to_usd(row["average_cost_for_two"], row["currency"]), axis=1)
     
     # Apply data cleaning and transformation
-    df = data_transform(data)
+    return data_transform(data)
+
+# Main function
+def main():
+    # The dataset is shared, the session keeps a reference and its derived nodes
+    reset_node_stats()
+    df = source_node('countries/df', prepare_data())
 
     # Perform data visualization
     data_viz(df)
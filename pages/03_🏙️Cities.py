@@ -3,6 +3,8 @@ import inflection
 import plotly.express as px
 import streamlit as st
 
+from foodzone import (EXCHANGE_RATES, compute_node, export_sidebar, reset_node_stats, show_node_stats, source_node, validate_data)
+
 from PIL import Image
 
 
@@ -46,42 +48,26 @@ def country_name(country_id):
     return COUNTRIES[country_id]
 
 # convert values to us dollar
-exchange_rates = {
-    'Botswana Pula(P)': 0.018,
-    'Brazilian Real(R$)': 0.20,
-    'Emirati Diram(AED)': 0.27,
-    'Indian Rupees(Rs.)': 0.012,
-    'Indonesian Rupiah(IDR)': 0.000067,
-    'NewZealand($)': 0.62,
-    'Pounds(£)': 1.24,
-    'Qatari Rial(QR)': 0.27,
-    'Rand(R)': 0.053,
-    'Sri Lankan Rupee(LKR)': 0.0033,
-    'Turkish Lira(TL)': 0.050,
-    'Dollar($)' : 1.0
-}
 def convert_to_usd(amount, currency):
-    if currency in exchange_rates:
-        return amount * exchange_rates[currency]
+    if currency in EXCHANGE_RATES:
+        return amount * EXCHANGE_RATES[currency]
     else:
         return None
 
 # data cleaning and transformation
 def data_transform(df):
-   # drop rows with null values
-    df = df.dropna()
-
-    # drop duplicate values
-    df = df.drop_duplicates().reset_index(drop=True)
+    # validate and drop duplicated restaurants in a single pass
+    df, _ = validate_data(df)
 
     #simplify the cuisines column
-    df["cuisines"] = df.loc[:, "cuisines"].apply(lambda x: x.split(",")[0])
-
-    # drop outliers
-    filt = df['amount_usd'] != 25000017.0
-    df = df.loc[filt, :]
+    df["cuisines"] = df["cuisines"].fillna("Others").str.split(",").str[0]
     return df
 
+# top cities by number of restaurants
+def top_cities_by_count(df, n):
+    rating_by_city = df[['restaurant_id', 'city', 'country_code']].groupby(['city', 'country_code']).count().sort_values('restaurant_id', ascending=False).reset_index()
+    return rating_by_city.head(n)
+
 # Data visualization
 def data_viz(df):
     # set streamlit page
@@ -99,11 +85,12 @@ def data_viz(df):
         options=df['country_code'].unique(),
         default=df['country_code'].unique()
         )
+    countries = frozenset(country_filter)
 
     
-    # Filter functionality 
-    select_row = df['country_code'].isin(country_filter)
-    df = df.loc[select_row, :]
+    # Filter functionality, one mask over the dataset shared by every chart
+    select_row = compute_node('cities/mask', deps=['cities/df'], params=countries,
+                              compute=lambda df: df['country_code'].isin(countries).to_numpy())
 
     st.sidebar.write("""___""")
 
@@ -112,13 +99,14 @@ def data_viz(df):
 
     # Top 10 Cities with more restaurants Chart
     with st.container():
-        restaurant_by = df[['city', 'restaurant_id', 'country_code']].groupby(['city', 'country_code']).nunique().sort_values('restaurant_id', ascending=False).reset_index()
-        top_10_cities = restaurant_by.sort_values('restaurant_id', ascending=False).head(10)
-        fig = px.bar(top_10_cities, x='city', y='restaurant_id',
-                        title= 'Top 10 Cities with more restaurants',
-                        color='country_code',
-                        text_auto=True,
-                        labels={'city': 'City', 'restaurant_id': 'Restaurants'})
+        top_10_cities = compute_node('cities/top_10_cities', deps=['cities/df', 'cities/mask'],
+                                     compute=lambda df, mask: df.loc[mask, ['city', 'restaurant_id', 'country_code']].groupby(['city', 'country_code']).nunique().sort_values('restaurant_id', ascending=False).reset_index().head(10))
+        fig = compute_node('cities/top_10_cities_fig', deps=['cities/top_10_cities'],
+                           compute=lambda top_10_cities: px.bar(top_10_cities, x='city', y='restaurant_id',
+                                title= 'Top 10 Cities with more restaurants',
+                                color='country_code',
+                                text_auto=True,
+                                labels={'city': 'City', 'restaurant_id': 'Restaurants'}))
         st.plotly_chart(fig, use_container_width=True)
 
     # Top 7 charts
@@ -127,55 +115,60 @@ def data_viz(df):
 
         with col1:
             # Top 7 Cities with more restaurants rating > 4 chart
-            df1 = df[df['aggregate_rating'] >= 4.0]
-            rating_by_city = df1[['restaurant_id', 'city', 'country_code']].groupby(['city', 'country_code']).count().sort_values('restaurant_id', ascending=False).reset_index()
-            top_7_cities = rating_by_city.sort_values('restaurant_id', ascending=False).head(7)
-            fig = px.bar(top_7_cities, x = 'city', y= 'restaurant_id',
-                        title= 'Top 7 Cities with more restaurants rating > 4',
-                        text_auto=True,
-                        color='country_code',
-                        labels={'city': 'City', 'restaurant_id': 'Restaurants'})
+            top_7_best_cities = compute_node('cities/top_7_best_cities', deps=['cities/df', 'cities/mask'],
+                                             compute=lambda df, mask: top_cities_by_count(df[mask & (df['aggregate_rating'] >= 4.0)], 7))
+            fig = compute_node('cities/top_7_best_cities_fig', deps=['cities/top_7_best_cities'],
+                               compute=lambda top_7_cities: px.bar(top_7_cities, x = 'city', y= 'restaurant_id',
+                                    title= 'Top 7 Cities with more restaurants rating > 4',
+                                    text_auto=True,
+                                    color='country_code',
+                                    labels={'city': 'City', 'restaurant_id': 'Restaurants'}))
             st.plotly_chart(fig, use_container_width=True)
 
         # Top 7 Cities with more restaurants rating < 2,5
         with col2:
-            df1 = df[
-                (df['aggregate_rating'] <= 2.5) 
-                    ]
-            rating_by_city = df1[['restaurant_id', 'city', 'country_code']].groupby(['city', 'country_code']).count().sort_values('restaurant_id', ascending=False).reset_index()
-            top_7_cities = rating_by_city.sort_values('restaurant_id', ascending=False).head(7)
-            fig = px.bar(top_7_cities, 
-                         x = 'city', 
-                         y= 'restaurant_id',
-                        title= 'Top 7 Cities with more restaurants rating < 2,5',
-                        text_auto=True,
-                        color='country_code',
-                        labels={'city': 'City', 'restaurant_id': 'Restaurants'}
-                        )
+            top_7_worst_cities = compute_node('cities/top_7_worst_cities', deps=['cities/df', 'cities/mask'],
+                                              compute=lambda df, mask: top_cities_by_count(df[mask & (df['aggregate_rating'] <= 2.5)], 7))
+            fig = compute_node('cities/top_7_worst_cities_fig', deps=['cities/top_7_worst_cities'],
+                               compute=lambda top_7_cities: px.bar(top_7_cities, 
+                                     x = 'city', 
+                                     y= 'restaurant_id',
+                                    title= 'Top 7 Cities with more restaurants rating < 2,5',
+                                    text_auto=True,
+                                    color='country_code',
+                                    labels={'city': 'City', 'restaurant_id': 'Restaurants'}
+                                    ))
             st.plotly_chart(fig, use_container_width=True)
 
     # Top 10 Cities with more different cuisines
     with st.container():
-        cuisines_by_city = df[['city', 'cuisines', 'country_code']].groupby(['city', 'country_code']).nunique().sort_values('cuisines', ascending=False).reset_index()
-        top_10_cuisines = cuisines_by_city.sort_values('cuisines', ascending=False).head(10)
-        fig = px.bar(top_10_cuisines,
-                    x='city',
-                    y='cuisines',
-                    title= 'Top 10 Cities with more different cuisines',
-                    text_auto=True,
-                    color='country_code',
-                    labels={'city': 'City', 'cuisines': 'Cuisines'}
-                    )
+        top_10_cuisines = compute_node('cities/top_10_cuisines', deps=['cities/df', 'cities/mask'],
+                                       compute=lambda df, mask: df.loc[mask, ['city', 'cuisines', 'country_code']].groupby(['city', 'country_code']).nunique().sort_values('cuisines', ascending=False).reset_index().head(10))
+        fig = compute_node('cities/top_10_cuisines_fig', deps=['cities/top_10_cuisines'],
+                           compute=lambda top_10_cuisines: px.bar(top_10_cuisines,
+                                x='city',
+                                y='cuisines',
+                                title= 'Top 10 Cities with more different cuisines',
+                                text_auto=True,
+                                color='country_code',
+                                labels={'city': 'City', 'cuisines': 'Cuisines'}
+                                ))
         st.plotly_chart(fig, use_container_width=True)
 
-# call functions
-    data = load_data('dataset\zomato.csv')
-    data = rename_columns(data)
-    data['country_code'] = data['country_code'].map(country_name)
-    data["amount_usd"] = data.apply(lambda row: convert_to_usd(row["average_cost_for_two"], row["currency"]), axis=1)
-    df = data_transform(data)
+    # Downloads of the filtered rows and the aggregates behind each chart
+    export_sidebar('cities', {
+        'Filtered restaurants': (df, select_row),
+        'Top cities by restaurants': top_10_cities,
+        'Top cities rating above 4': top_7_best_cities,
+        'Top cities rating below 2.5': top_7_worst_cities,
+        'Top cities by cuisines': top_10_cuisines,
+    })
 
-def main():
+    show_node_stats()
+
+# load and clean the dataset once, every session shares this frame and never modifies it
+@st.cache_resource
+def prepare_data():
     #Load data
     data = load_data('zomato.csv')
 
@@ -189,7 +182,12 @@ def main():
     data["amount_usd"] = data.apply(lambda row: convert_to_usd(row["average_cost_for_two"], row["currency"]), axis=1)
 
     # Apply data cleaning and transformation
-    df = data_transform(data)
+    return data_transform(data)
+
+def main():
+    # the dataset is shared, the session keeps a reference and its derived nodes
+    reset_node_stats()
+    df = source_node('cities/df', prepare_data())
 
     # Perform data viz
     data_viz(df)
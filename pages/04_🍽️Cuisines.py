@@ -1,8 +1,11 @@
+import numpy as np
 import pandas as pd
 import inflection
 import plotly.express as px
 import streamlit as st
 
+from foodzone import (EXCHANGE_RATES, additive_node, compute_node, export_sidebar, reset_node_stats, show_node_stats, source_node, validate_data)
+
 from PIL import Image
 
 # Load dataset
@@ -47,44 +50,69 @@ def country_name(country_id):
 
 
 # Convert values to us dollar
-exchange_rates = {
-    'Botswana Pula(P)': 0.018,
-    'Brazilian Real(R$)': 0.20,
-    'Emirati Diram(AED)': 0.27,
-    'Indian Rupees(Rs.)': 0.012,
-    'Indonesian Rupiah(IDR)': 0.000067,
-    'NewZealand($)': 0.62,
-    'Pounds(£)': 1.24,
-    'Qatari Rial(QR)': 0.27,
-    'Rand(R)': 0.053,
-    'Sri Lankan Rupee(LKR)': 0.0033,
-    'Turkish Lira(TL)': 0.050,
-    'Dollar($)' : 1.0
-}
-
 def convert_to_usd(amount, currency):
-    if currency in exchange_rates:
-        return amount * exchange_rates[currency]
+    if currency in EXCHANGE_RATES:
+        return amount * EXCHANGE_RATES[currency]
     else:
         return None
 
 
 # Data cleaning
 def data_transform(df):
-   # drop rows with null values
-    df = df.dropna()
-
-    # drop duplicate values
-    df = df.drop_duplicates().reset_index(drop=True)
+    # validate and drop duplicated restaurants in a single pass
+    df, _ = validate_data(df)
 
     #simplify the cuisines column
-    df["cuisines"] = df.loc[:, "cuisines"].apply(lambda x: x.split(",")[0])
-
-    # drop outliers
-    filt = df['amount_usd'] != 25000017.0
-    df = df.loc[filt, :]
+    df["cuisines"] = df["cuisines"].fillna("Others").str.split(",").str[0]
     return df
 
+# Vote weighted ranking
+RANKING_LEVELS = {
+    'cuisine': 'cuisines',
+    'city': 'city',
+    'country': 'country_code',
+}
+
+def bayesian_score(rating_sum, votes, prior_mean, prior_votes):
+    # Mean rating as if every item had prior_votes extra votes at prior_mean
+    return (rating_sum + prior_votes * prior_mean) / (votes + prior_votes)
+
+def score_priors(df):
+    # Mean rating over all votes, and the median votes of a voted restaurant
+    prior_mean = (df['aggregate_rating'] * df['votes']).sum() / df['votes'].sum()
+    prior_votes = df.loc[df['votes'] > 0, 'votes'].median()
+    return prior_mean, prior_votes
+
+def rank_scores(df):
+    weighted = df['aggregate_rating'] * df['votes']
+    prior_mean, prior_votes = score_priors(df)
+
+    # Restaurant scores, then every group level from the same vote sums
+    df['restaurant_score'] = bayesian_score(weighted, df['votes'], prior_mean, prior_votes)
+    for name, col in RANKING_LEVELS.items():
+        rating_sum = weighted.groupby(df[col]).transform('sum')
+        votes = df['votes'].groupby(df[col]).transform('sum')
+        df[f'{name}_score'] = bayesian_score(rating_sum, votes, prior_mean, prior_votes)
+        df[f'{name}_rank'] = df[f'{name}_score'].rank(method='dense', ascending=False).astype(int)
+
+    # Sort once, filters keep the order so top N is a head() slice
+    return df.sort_values('restaurant_score', ascending=False, ignore_index=True)
+
+def cuisine_partials(df):
+    # Vote sums per (country, cuisine), the selected countries are added up from them
+    return (df.assign(rating_sum=df['aggregate_rating'] * df['votes'])
+              .groupby(['country_code', 'cuisines'])
+              .agg(restaurants=('restaurant_id', 'size'), rating_sum=('rating_sum', 'sum'), votes=('votes', 'sum')))
+
+def cuisine_scores(totals, cuisines, prior_votes):
+    # Scores of the selected cuisines from the vote sums of the selected countries,
+    # shrunk towards the mean rating of those countries
+    prior_mean = totals['rating_sum'].sum() / totals['votes'].sum()
+    totals = totals[totals.index.isin(cuisines)]
+    scores = totals[['restaurants', 'votes']].assign(
+        cuisine_score=bayesian_score(totals['rating_sum'], totals['votes'], prior_mean, prior_votes))
+    return scores.rename_axis('cuisines').reset_index()
+
 def data_viz(df):
    # Set streamlit page
    st.set_page_config(layout='wide')
@@ -111,13 +139,22 @@ def data_viz(df):
                         options=df['cuisines'].unique(),
                         default=df['cuisines'].unique())
    
-   # Country Filter functionality 
-   select_row = df['country_code'].isin(country_filter)
-   df = df.loc[select_row, :]
+   countries, cuisines = frozenset(country_filter), frozenset(cuisine_filter)
+
+   # Country and cuisine type filter functionality, one mask over the dataset
+   select_row = compute_node('cuisines/mask', deps=['cuisines/df'], params=(countries, cuisines),
+                             compute=lambda df: (df['country_code'].isin(countries) & df['cuisines'].isin(cuisines)).to_numpy())
 
-   # Cuisine type filter functionality
-   cuisine_row_filter = df['cuisines'].isin(cuisine_filter)
-   df = df.loc[cuisine_row_filter, :]
+   # Cuisine scores follow the country filter, summed from per country partials
+   compute_node('cuisines/prior_votes', lambda df: score_priors(df)[1], deps=['cuisines/df'])
+   compute_node('cuisines/cuisine_partials', cuisine_partials, deps=['cuisines/df'])
+   additive_node('cuisines/cuisine_totals', 'cuisines/cuisine_partials', countries)
+   compute_node('cuisines/cuisine_scores', deps=['cuisines/cuisine_totals', 'cuisines/prior_votes'], params=cuisines,
+                compute=lambda totals, prior_votes: cuisine_scores(totals, cuisines, prior_votes))
+
+   # Best restaurant of each cuisine, the frame is sorted by score
+   best_restaurants = compute_node('cuisines/best_restaurants', deps=['cuisines/df', 'cuisines/mask'],
+                                   compute=lambda df, mask: df[mask].drop_duplicates('cuisines', ignore_index=True))
 
    st.sidebar.write("""___""")
 
@@ -133,8 +170,8 @@ def data_viz(df):
       col1, col2, col3, col4, col5 = st.columns(5)
 
       with col1: #North indian
-         df1 = df[df['cuisines'] == 'Indian']
-         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city' ]].groupby('restaurant_name').max().sort_values('aggregate_rating', ascending=False).reset_index()
+         df1 = best_restaurants[best_restaurants['cuisines'] == 'Indian']
+         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city' ]].head(1)
          help1 = (f'Place: {df2.iloc[0,4]}/  {df2.iloc[0,2]} \n\n Price for Two: U${df2.iloc[0,3]} \n\n ' )
          st.metric(value=df2.iloc[0,1], 
                   label=(f'Indian: {df2.iloc[0,0]}'),
@@ -142,32 +179,32 @@ def data_viz(df):
          
 
       with col2: # American
-         df1 = df[df['cuisines'] == 'American']
-         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].groupby('restaurant_name').max().sort_values('aggregate_rating', ascending=False).reset_index()
+         df1 = best_restaurants[best_restaurants['cuisines'] == 'American']
+         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].head(1)
          help1 = (f'Place: {df2.iloc[0,4]}/  {df2.iloc[0,2]} \n\n Price for Two: U${df2.iloc[0,3]} \n\n ' )
          st.metric(value=df2.iloc[0,1], 
                   label=(f'American: {df2.iloc[0,0]}'),
                   help = help1)
       
       with col3: # Cafe
-         df1 = df[df['cuisines'] == 'Cafe']
-         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].groupby('restaurant_name').max().sort_values('aggregate_rating', ascending=False).reset_index()
+         df1 = best_restaurants[best_restaurants['cuisines'] == 'Cafe']
+         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].head(1)
          help1 = (f'Place: {df2.iloc[0,4]}/  {df2.iloc[0,2]} \n\n Price for Two: U${df2.iloc[0,3]} \n\n ' )
          st.metric(value=df2.iloc[0,1], 
                   label=(f'Cafe: {df2.iloc[0,0]}'),
                   help= help1)
 
       with col4: # Italian
-         df1 = df[df['cuisines'] == 'Italian']
-         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].groupby('restaurant_name').max().sort_values('aggregate_rating', ascending=False).reset_index()
+         df1 = best_restaurants[best_restaurants['cuisines'] == 'Italian']
+         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].head(1)
          help1 = (f'Place: {df2.iloc[0,4]}/  {df2.iloc[0,2]} \n\n Price for Two: U${df2.iloc[0,3]} \n\n ' )
          st.metric(value=df2.iloc[0,1], 
                   label=(f'Italian: {df2.iloc[0,0]}'),
                   help=help1)
       
       with col5: # Pizza
-         df1 = df[df['cuisines'] == 'Pizza']
-         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].groupby('restaurant_name').max().sort_values('aggregate_rating', ascending=False).reset_index()
+         df1 = best_restaurants[best_restaurants['cuisines'] == 'Pizza']
+         df2 = df1[['restaurant_name', 'aggregate_rating', 'country_code', 'amount_usd', 'city']].head(1)
          help1 = (f'Place: {df2.iloc[0,4]}/  {df2.iloc[0,2]} \n\n Price for Two: U${df2.iloc[0,3]} \n\n ' )
          st.metric(value=df2.iloc[0,1], 
                   label=(f'Pizza: {df2.iloc[0,0]}'),
@@ -179,10 +216,10 @@ def data_viz(df):
    # Top N Restaurants table
    with st.container():
       st.title(f'Top {number_filter} Resturants')
-      df1 = df.sort_values('aggregate_rating', ascending=False).head(number_filter).reset_index(drop=True)
-      df2 = df1.loc[:, ['restaurant_id', 'restaurant_name', 'country_code', 
-                        'city', 'cuisines', 'amount_usd', 'aggregate_rating', 'rating_text']]
-      st.dataframe(df2, use_container_width=True)
+      top_restaurants = compute_node('cuisines/top_restaurants', deps=['cuisines/df', 'cuisines/mask'], params=number_filter,
+                                     compute=lambda df, mask: df.iloc[np.flatnonzero(mask)[:number_filter]].reset_index(drop=True).loc[:, ['restaurant_id', 'restaurant_name', 'country_code', 
+                                                            'city', 'cuisines', 'amount_usd', 'aggregate_rating', 'votes', 'restaurant_score', 'rating_text']])
+      st.dataframe(top_restaurants, use_container_width=True)
 
 
    # Best and Worst rated cuisines
@@ -191,35 +228,49 @@ def data_viz(df):
 
       # Top N best rated cuisines
       with col1:
-         dff = df[df['votes'] >= 100]
-         df1 = dff[['cuisines', 'aggregate_rating']].groupby('cuisines').mean().sort_values('aggregate_rating', ascending=False).reset_index()
-         df2 = df1[df1['cuisines'] != 'Others']
-         df3 = df2.iloc[:number_filter, :]
-         fig = px.bar(
-            df3, 
-            x='cuisines', 
-            y='aggregate_rating',
-            title=(f' Top {number_filter} best rated cuisines'),
-            text_auto=True
-         )
+         best_cuisines = compute_node('cuisines/best_cuisines', deps=['cuisines/cuisine_scores'], params=number_filter,
+                                      compute=lambda df1: df1[df1['cuisines'] != 'Others'].nlargest(number_filter, 'cuisine_score'))
+         fig = compute_node('cuisines/best_cuisines_fig', deps=['cuisines/best_cuisines'],
+                            compute=lambda df3: px.bar(
+                               df3, 
+                               x='cuisines', 
+                               y='cuisine_score',
+                               title=(f' Top {number_filter} best rated cuisines'),
+                               text_auto='.2f',
+                               labels={'cuisines': 'Cuisines', 'cuisine_score': 'Score'}
+                            ))
          st.plotly_chart(fig, use_container_width=True)
 
       # Top N worst rated cuisines
       with col2:
-         df1 = df[['cuisines', 'aggregate_rating']].groupby('cuisines').mean().sort_values('aggregate_rating', ascending=True).reset_index()
-         df2 = df1[df1['aggregate_rating'] >= 1]
-         df3 = df2.iloc[:number_filter, :]
-         fig = px.bar(
-            df3,
-            x='cuisines',
-            y='aggregate_rating',
-            title=(f' Top {number_filter} worst rated cuisines'),
-            text_auto=True
-         )
+         worst_cuisines = compute_node('cuisines/worst_cuisines', deps=['cuisines/cuisine_scores'], params=number_filter,
+                                       compute=lambda df1: df1.nsmallest(number_filter, 'cuisine_score'))
+         fig = compute_node('cuisines/worst_cuisines_fig', deps=['cuisines/worst_cuisines'],
+                            compute=lambda df2: px.bar(
+                               df2,
+                               x='cuisines',
+                               y='cuisine_score',
+                               title=(f' Top {number_filter} worst rated cuisines'),
+                               text_auto='.2f',
+                               labels={'cuisines': 'Cuisines', 'cuisine_score': 'Score'}
+                            ))
          st.plotly_chart(fig, use_container_width=True)
+
+   # Downloads of the filtered rows and the aggregates behind each chart
+   export_sidebar('cuisines', {
+      'Filtered restaurants': (df, select_row),
+      'Best restaurant per cuisine': best_restaurants,
+      'Top restaurants': top_restaurants,
+      'Best rated cuisines': best_cuisines,
+      'Worst rated cuisines': worst_cuisines,
+   })
+
+   show_node_stats()
      
          
-def main():      
+# Load and clean the dataset once, every session shares this frame and never modifies it
+@st.cache_resource
+def prepare_data():
    # Load data
    data = load_data('zomato.csv')
 
@@ -235,6 +286,14 @@ def main():
    # Apply data cleaning
    df = data_transform(data)
 
+   # Compute vote weighted scores
+   return rank_scores(df)
+
+def main():
+   # The dataset is shared, the session keeps a reference and its derived nodes
+   reset_node_stats()
+   df = source_node('cuisines/df', prepare_data())
+
    # Perform data viz
    data_viz(df)
 
@@ -0,0 +1,308 @@
+import time
+
+import numpy as np
+import pandas as pd
+import inflection
+import streamlit as st
+
+from foodzone import (EXCHANGE_RATES, compute_node, export_sidebar, reset_node_stats, show_node_stats, source_node, validate_data)
+
+from PIL import Image
+
+# Load dataset
+def load_data(path):
+   data = pd.read_csv(path)
+   return data
+
+# Rename columns set underscore
+def rename_columns(dataframe):
+    df = dataframe.copy()
+    title = lambda x: inflection.titleize(x)
+    snakecase = lambda x: inflection.underscore(x)
+    spaces = lambda x: x.replace(" ", "")
+    cols_old = list(df.columns)
+    cols_old = list(map(title, cols_old))
+    cols_old = list(map(spaces, cols_old))
+    cols_new = list(map(snakecase, cols_old))
+    df.columns = cols_new
+    return df
+
+# Country names function
+COUNTRIES = {
+1: "India",
+14: "Australia",
+30: "Brazil",
+37: "Canada",
+94: "Indonesia",
+148: "New Zeland",
+162: "Philippines",
+166: "Qatar",
+184: "Singapure",
+189: "South Africa",
+191: "Sri Lanka",
+208: "Turkey",
+214: "United Arab Emirates",
+215: "England",
+216: "United States of America",
+}
+
+def country_name(country_id):
+    return COUNTRIES[country_id]
+
+
+# Convert values to us dollar
+def convert_to_usd(amount, currency):
+    if currency in EXCHANGE_RATES:
+        return amount * EXCHANGE_RATES[currency]
+    else:
+        return None
+
+
+# Data cleaning
+def data_transform(df):
+    # validate and drop duplicated restaurants in a single pass
+    df, _ = validate_data(df)
+
+    # keep every cuisine for the similarity features, then simplify the cuisines column
+    df["all_cuisines"] = df["cuisines"].fillna("Others")
+    df["cuisines"] = df["all_cuisines"].str.split(",").str[0]
+    return df
+
+# Restaurant features
+NUMERIC_FEATURES = ['price_range', 'aggregate_rating', 'votes', 'has_table_booking', 'has_online_delivery']
+EARTH_RADIUS_KM = 6371.0
+
+def restaurant_features(df):
+    # Every cuisine is its own column, kept sparse as the rows of each cuisine
+    # (and the cuisines of each row) instead of a mostly zero matrix
+    cuisines = df['all_cuisines'].str.split(',').explode().str.strip()
+    pairs = pd.DataFrame({'row': cuisines.index.to_numpy(), 'code': pd.factorize(cuisines)[0]}).drop_duplicates()
+    by_cuisine = pairs.sort_values(['code', 'row'], kind='stable')
+    cuisine_counts = np.bincount(pairs['code'])
+    row_counts = np.bincount(pairs['row'], minlength=len(df))
+
+    # Numerics scaled to [0, 1], votes on a log scale
+    numeric = df[NUMERIC_FEATURES].to_numpy(dtype=np.float32)
+    numeric[:, NUMERIC_FEATURES.index('votes')] = np.log1p(numeric[:, NUMERIC_FEATURES.index('votes')])
+    low, high = numeric.min(axis=0), numeric.max(axis=0)
+    numeric = (numeric - low) / np.where(high > low, high - low, 1.0)
+
+    # Unit rows, so a dot product is the cosine similarity: a cuisine shared by two
+    # rows adds the product of their scales, the numerics are stored already scaled
+    scale = (1.0 / np.sqrt(row_counts + (numeric ** 2).sum(axis=1))).astype(np.float32)
+    features = {
+        'numeric': np.asfortranarray(numeric * scale[:, None]),
+        'scale': scale,
+        'cuisine_start': np.concatenate([[0], np.cumsum(cuisine_counts)]),
+        'cuisine_rows': by_cuisine['row'].to_numpy(),
+        'row_start': np.concatenate([[0], np.cumsum(row_counts)]),
+        'row_cuisines': pairs['code'].to_numpy(),
+    }
+
+    coords = np.asfortranarray(np.radians(df[['latitude', 'longitude']].to_numpy(dtype=np.float64)))
+    return features, coords
+
+@st.cache_resource
+def shared_features():
+    # A single read only copy for every session, st.cache_data would copy it on each run
+    features, coords = restaurant_features(prepare_data())
+    for array in [*features.values(), coords]:
+        array.flags.writeable = False
+    return features, coords
+
+def distance_km(coords, origin):
+    # Haversine distance from origin to every row of coords, in radians
+    dlat = coords[:, 0] - origin[0]
+    dlon = coords[:, 1] - origin[1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(origin[0]) * np.cos(coords[:, 0]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def nearby_rows(coords, select_row, origin, radius):
+    # A latitude band around origin discards most rows with one comparison, then the
+    # longitude box and the haversine distance only run on the rows inside the band
+    dlat = radius / EARTH_RADIUS_KM
+    rows = np.flatnonzero((np.abs(coords[:, 0] - origin[0]) <= dlat) & select_row)
+    dlon = np.arcsin(min(1.0, np.sin(dlat) / np.cos(origin[0])))
+    rows = rows[np.abs((coords[rows, 1] - origin[1] + np.pi) % (2 * np.pi) - np.pi) <= dlon]
+    return rows[distance_km(coords[rows], origin) <= radius]
+
+def similar_restaurants(features, queries, k, candidates):
+    # Score a batch of queries against the candidate rows only, reading just the
+    # columns the queries use, since the others add zero to every dot product
+    queries = np.atleast_1d(queries)
+    numeric, scale = features['numeric'], features['scale']
+    every_row = len(candidates) == len(scale)
+    cols = np.flatnonzero(numeric[queries].any(axis=0))
+    block = numeric[:, cols] if every_row else numeric[np.ix_(candidates, cols)]
+    scores = block @ numeric[np.ix_(queries, cols)].T
+
+    # Cuisines: count the ones each row shares with the query, visiting only the
+    # rows of the query's own cuisines
+    candidate_scale = scale if every_row else scale[candidates]
+    cuisine_start, cuisine_rows = features['cuisine_start'], features['cuisine_rows']
+    for i, query in enumerate(queries):
+        shared = np.zeros(len(scale), dtype=np.float32)
+        for code in features['row_cuisines'][features['row_start'][query]:features['row_start'][query + 1]]:
+            shared[cuisine_rows[cuisine_start[code]:cuisine_start[code + 1]]] += 1
+        scores[:, i] += (shared if every_row else shared[candidates]) * candidate_scale * scale[query]
+
+    # The queries themselves never make the top k
+    position = np.searchsorted(candidates, queries)
+    found = position < len(candidates)
+    found[found] = candidates[position[found]] == queries[found]
+    scores[position[found], np.flatnonzero(found)] = -np.inf
+
+    # Partition the negated scores in place instead of allocating a copy
+    k = min(k, len(candidates))
+    if k == 0:
+        return np.empty((0, len(queries)), dtype=np.intp), np.empty((0, len(queries)), dtype=scores.dtype)
+    np.negative(scores, out=scores)
+    top = np.argpartition(scores, k - 1, axis=0)[:k]
+    top = np.take_along_axis(top, np.argsort(np.take_along_axis(scores, top, axis=0), axis=0), axis=0)
+    return candidates[top], -np.take_along_axis(scores, top, axis=0)
+
+def similar_table(df, features, coords, select_row, query, k, radius=None):
+    # The table, with the number of restaurants compared and the time spent ranking them
+    start = time.perf_counter()
+    if radius is None:
+        candidates = np.flatnonzero(select_row)
+    else:
+        candidates = nearby_rows(coords, select_row, coords[query], radius)
+    similar, score = similar_restaurants(features, query, k, candidates)
+
+    found = np.isfinite(score[:, 0])
+    similar, score = similar[found, 0], score[found, 0]
+    # Positional rows first, selecting the columns of the whole frame copies every row
+    df1 = df.iloc[similar][['restaurant_name', 'country_code', 'city', 'all_cuisines',
+                            'amount_usd', 'aggregate_rating', 'votes']]
+    df1['similarity'] = score.round(3)
+    df1['distance_km'] = distance_km(coords[similar], coords[query]).round(1)
+    return df1.reset_index(drop=True), len(candidates), time.perf_counter() - start
+
+# Restaurant search
+MAX_MATCHES = 100
+
+def search_restaurants(df, select_row, text):
+    # Selected rows whose name contains the text, capped so the picker stays small
+    rows = np.flatnonzero(select_row)
+    if text:
+        names = df['restaurant_name'].iloc[rows]
+        rows = rows[names.str.contains(text, case=False, regex=False).to_numpy()]
+    return rows[:MAX_MATCHES]
+
+def data_viz(df):
+    # Set streamlit page
+    st.set_page_config(layout='wide')
+
+    # Sidebar configuration
+    image = Image.open('logo.png')
+    st.sidebar.image(image, width=150)
+    st.sidebar.header('Food Zone')
+    st.sidebar.subheader('Your food in your zone')
+    st.sidebar.write("""___""")
+
+    # Filters
+    st.sidebar.markdown('# Filters')
+    country_filter = st.sidebar.multiselect(
+        label='Choose the countries',
+        options=df['country_code'].unique(),
+        default=df['country_code'].unique()
+    )
+
+    number_filter = st.sidebar.slider(label='Number of Restaurants', max_value=20, min_value=1, value=10)
+
+    nearby_filter = st.sidebar.checkbox('Only nearby restaurants')
+    if nearby_filter:
+        radius_filter = st.sidebar.slider(label='Distance (km)', max_value=50, min_value=1, value=5)
+
+    st.sidebar.write("""___""")
+
+    # Features are built once for the whole dataset
+    source_node('recommendations/features', shared_features())
+
+    # Filter functionality
+    countries = frozenset(country_filter)
+    select_row = compute_node('recommendations/mask', deps=['recommendations/df'], params=countries,
+                              compute=lambda df: df['country_code'].isin(countries).to_numpy())
+
+    st.title('🔎 Similar Restaurants')
+
+    if not select_row.any():
+        st.warning('Choose at least one country')
+        return
+
+    # Restaurant to compare with, searched by name instead of listing every selected row
+    search = st.text_input(label='Search a restaurant', placeholder='Restaurant name')
+    matches = compute_node('recommendations/matches', deps=['recommendations/df', 'recommendations/mask'], params=search,
+                           compute=lambda df, mask: search_restaurants(df, mask, search))
+    if not len(matches):
+        st.warning('No restaurant matches the search')
+        return
+
+    query = st.selectbox(
+        label=f'Restaurant (first {MAX_MATCHES} matches)',
+        options=matches,
+        format_func=lambda i: f"{df.at[i, 'restaurant_name']} - {df.at[i, 'city']}/ {df.at[i, 'country_code']}"
+    )
+
+    with st.container():
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric(value=df.at[query, 'aggregate_rating'], label='Rating')
+        with col2:
+            st.metric(value=df.at[query, 'votes'], label='Votes')
+        with col3:
+            st.metric(value=f"U${df.at[query, 'amount_usd']:.2f}", label='Price for Two')
+        with col4:
+            st.metric(value=df.at[query, 'price_range'], label='Price Range')
+        st.caption(f"Cuisines: {df.at[query, 'all_cuisines']}")
+
+    # Top k similar restaurants
+    with st.container():
+        radius = radius_filter if nearby_filter else None
+        df1, compared, elapsed = compute_node('recommendations/similar',
+                                              deps=['recommendations/df', 'recommendations/features', 'recommendations/mask'],
+                                              params=(query, number_filter, radius),
+                                              compute=lambda df, data, mask: similar_table(df, *data, mask, query, number_filter, radius))
+
+        st.header('Best alternatives nearby' if nearby_filter else 'Restaurants like this one')
+        st.dataframe(df1, use_container_width=True)
+        st.caption(f'{compared} restaurants compared in {elapsed * 1000:.1f} ms')
+
+    # Downloads of the filtered rows and the similar restaurants
+    export_sidebar('recommendations', {
+        'Filtered restaurants': (df, select_row),
+        'Similar restaurants': df1,
+    })
+
+    show_node_stats()
+
+# Load and clean the dataset once, every session shares this frame and never modifies it
+@st.cache_resource
+def prepare_data():
+    # Load data
+    data = load_data('zomato.csv')
+
+    # Rename columns
+    data = rename_columns(data)
+
+    # Map country codes to names
+    data['country_code'] = data['country_code'].map(country_name)
+
+    # Convert avg cost to USD
+    data["amount_usd"] = data.apply(lambda row: convert_to_usd(row["average_cost_for_two"], row["currency"]), axis=1)
+
+    # Apply data cleaning
+    return data_transform(data)
+
+def main():
+    # The dataset is shared, the session keeps a reference and its derived nodes
+    reset_node_stats()
+    df = source_node('recommendations/df', prepare_data())
+
+    # Perform data viz
+    data_viz(df)
+
+# Run the main function
+if __name__ == '__main__':
+    main()